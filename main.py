@@ -1,8 +1,13 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
 import together
 import re
 import json
+import ast
+import os
+import tempfile
 
 # ------------------- Settings & API Key -------------------
 st.set_page_config(page_title="Creator Insight Extraction", layout="wide")
@@ -20,16 +25,76 @@ weight_followers = st.sidebar.slider("Follower Count", 0.0, 1.0, 0.3, 0.05)
 weight_likes = st.sidebar.slider("Avg Likes/Comments", 0.0, 1.0, 0.2, 0.05)
 
 # ------------------- Load Data -------------------
-@st.cache_data
-def load_data():
-    df = pd.read_csv("Mock_Creator_Engagement_Data.csv")
+# Frozen schema for the text columns, applied after parsing. Passing dtype= to
+# the pyarrow engine recasts unlisted nullable ints too, so numeric columns are
+# left to inference and blanks or stray text are coerced in load_data().
+CSV_DTYPES = {
+    "Name": "string",
+    "Category": "string",
+    "Posting Frequency": "string",
+    "Past Brand Collaborations": "string",
+}
+
+DATA_CSV = "Mock_Creator_Engagement_Data.csv"
+# Bump when CSV_DTYPES or the normalization in read_source_data() changes; the
+# version is part of the file name, so copies written by older code are never read
+PARQUET_SCHEMA_VERSION = 2
+DATA_PARQUET = f"Mock_Creator_Engagement_Data.v{PARQUET_SCHEMA_VERSION}.parquet"
+
+def read_source_data(csv_path=DATA_CSV, parquet_path=DATA_PARQUET):
+    # Use the Parquet copy unless it's missing or older than the CSV
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path):
+        try:
+            # Columns are already normalized in the Parquet file
+            return pd.read_parquet(parquet_path, engine="pyarrow")
+        except (OSError, pa.ArrowInvalid):
+            # Unreadable or truncated copy: rebuild it from the CSV below
+            pass
+    # pyarrow's CSV reader is multi-threaded
+    df = pd.read_csv(csv_path, engine="pyarrow")
+    df = df.astype({col: dtype for col, dtype in CSV_DTYPES.items() if col in df.columns})
     # Normalize column names: lowercase, underscores, no leading/trailing spaces
     df.columns = [col.strip().lower().replace(" ", "_") for col in df.columns]
+    # Write to a temp file and swap it in so readers never see a partial file
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(suffix=".parquet", dir=os.path.dirname(os.path.abspath(parquet_path)))
+        os.close(fd)
+        df.to_parquet(tmp_path, engine="pyarrow", compression="zstd", index=False)
+        # mkstemp creates the file as 0600; keep it readable if the app later runs as another user
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, parquet_path)
+    except OSError:
+        # Read-only app directory: keep serving the frame parsed from the CSV
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return df
+
+@st.cache_data
+def load_data():
+    df = read_source_data()
+    # Ranking inputs don't change between queries, so coerce them once here.
+    # float32 halves the memory the scoring pass has to stream through;
+    # follower_count stays int64 so large counts can't wrap around.
+    for col in ("engagement_rate_(%)", "average_likes/post", "average_comments/post"):
+        df[col] = pd.to_numeric(df[col], errors='coerce').fillna(0.0).astype('float32')
+    df['follower_count'] = pd.to_numeric(df['follower_count'], errors='coerce').fillna(0).astype('int64')
+    # Combine likes and comments per post
+    df['avg_likes_comments'] = df['average_likes/post'] + df['average_comments/post']
+    # Categorical storage lets rank_creators match on small integer codes
+    df['category'] = df['category'].astype('category')
     return df
 
 df = load_data()
 # st.write("Columns in data:", df.columns.tolist())  # Debug output hidden
-categories = df['category'].unique()
+# Read the category list once from the categorical instead of rescanning the column
+categories = tuple(df['category'].cat.categories)
+# Lowercased category name -> categorical codes (several when names differ only by case)
+category_codes = {}
+for code, name in enumerate(categories):
+    category_codes.setdefault(name.lower(), []).append(code)
+# (original, lowercased) pairs for substring matching against queries
+category_pairs = tuple((c, c.lower()) for c in categories)
 
 # ------------------- Query Examples & History -------------------
 st.title("Creator Insight Extraction (LLM via Together API)")
@@ -59,17 +124,45 @@ with st.expander("Query History", expanded=False):
         st.write(q)
 
 # ------------------- Query Parsing -------------------
-def extract_category_basic(query, categories):
+# Follower filter like ">10000", and the first {...} block in an LLM reply
+FILTER_RE = re.compile(r'([><=])\s*(\d+)')
+JSON_RE = re.compile(r'\{.*?\}', re.DOTALL)
+TRAILING_COMMA_RE = re.compile(r',\s*\}')
+
+def extract_category_basic(query, category_pairs):
     query_lower = query.lower()
-    for category in categories:
-        if category.lower() in query_lower:
+    for category, category_lower in category_pairs:
+        if category_lower in query_lower:
             return category
     return None
 
+class LLMReplyError(ValueError):
+    # Reply arrived but had no usable filter dict; carries the reply text
+    pass
+
 def parse_query_llm(query):
     if not together.api_key:
         st.warning("Together API key not found; using basic extraction.")
         return None
+    try:
+        return fetch_llm_filters(query)
+    except LLMReplyError as e:
+        st.error(f"LLM did not return JSON: {e}")
+        return None
+    except Exception as e:
+        st.error(f"Parsing error: {e}")
+        return None
+
+def stream_chunk_text(chunk):
+    # together 0.2.x streams plain text; the 1.x legacy client streams chunk dicts
+    if isinstance(chunk, str):
+        return chunk
+    choices = chunk.get("choices") or []
+    return (choices[0].get("text") or "") if choices else ""
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def fetch_llm_filters(query):
+    # Cached per query string; failures (including malformed replies) raise so they are never cached
     prompt = f"""
     Extract structured filters from this query: \"{query}\".
     Return JSON with fields: category, follower_filter (>,<,= value), sort_by.
@@ -77,71 +170,128 @@ def parse_query_llm(query):
     Input: \"Show top fashion creators with >10000 followers\"
     Output: {{\"category\":\"fashion\",\"follower_filter\":\">10000\",\"sort_by\":\"engagement rate\"}}
     """
+    stream = together.Complete.create_streaming(
+        model="mistralai/Mixtral-8x7B-Instruct-v0.1",
+        prompt=prompt,
+        max_tokens=60,
+        temperature=0
+    )
+    # Stop reading as soon as the first {...} block has fully arrived
+    parsed_text = ""
+    json_match = None
     try:
-        response = together.Complete.create(
-            model="mistralai/Mixtral-8x7B-Instruct-v0.1",
-            prompt=prompt,
-            max_tokens=100,
-            temperature=0
-        )
-        # Debug output removed for production
-        if 'choices' not in response or not response['choices']:
-            st.error(f"LLM API error: {response}")
-            return None
-        parsed_text = response['choices'][0]['text'].strip()
-        # Use regex to find the first {...} block in the text
-        json_match = re.search(r'\{.*?\}', parsed_text, re.DOTALL)
-        if json_match:
-            json_str = json_match.group(0)
-            try:
-                parsed = json.loads(json_str.replace("'", '"'))
-            except Exception:
-                parsed = eval(json_str)
-            return parsed
-        else:
-            st.error(f"LLM did not return JSON: {parsed_text}")
-            return None
-    except Exception as e:
-        st.error(f"Parsing error: {e}")
-        return None
+        for chunk in stream:
+            token = stream_chunk_text(chunk)
+            parsed_text += token
+            if '}' in token:
+                json_match = JSON_RE.search(parsed_text)
+                if json_match:
+                    break
+    finally:
+        stream.close()
+    parsed_text = parsed_text.strip()
+    if not json_match:
+        raise LLMReplyError(parsed_text)
+    json_str = json_match.group(0)
+    try:
+        # Tolerate single quotes and a trailing comma before the closing brace
+        parsed = json.loads(TRAILING_COMMA_RE.sub('}', json_str.replace("'", '"')))
+    except json.JSONDecodeError:
+        # Python-style literals (True/None, quotes inside values); never eval
+        parsed = ast.literal_eval(json_str)
+    # literal_eval also accepts sets like {"fashion"}; only a dict carries filters
+    if not isinstance(parsed, dict):
+        raise LLMReplyError(parsed_text)
+    return parsed
 
 # ------------------- Ranking Logic -------------------
+# Follower filter operator -> vectorized NumPy comparison
+FOLLOWER_OPS = {'>': np.greater, '<': np.less, '=': np.equal}
+
 def rank_creators(df, category, follower_filter=None, w_eng=0.5, w_fol=0.3, w_likes=0.2):
-    df_filtered = df[df['category'].str.lower() == category.lower()].copy()
+    codes = category_codes.get(category.lower())
+    if codes:
+        mask = np.isin(df['category'].cat.codes.values, codes)
+    else:
+        # Unknown category; don't compare against -1, which is the code for missing values
+        mask = np.zeros(len(df), dtype=bool)
     # Parse follower filter (e.g., ">10000")
     if follower_filter:
-        match = re.match(r'([><=])\s*(\d+)', follower_filter)
+        match = FILTER_RE.match(follower_filter)
         if match:
             op, value = match.groups()
             value = int(value)
-            if op == '>':
-                df_filtered = df_filtered[df_filtered['follower_count'] > value]
-            elif op == '<':
-                df_filtered = df_filtered[df_filtered['follower_count'] < value]
-            elif op == '=':
-                df_filtered = df_filtered[df_filtered['follower_count'] == value]
-    # Normalize follower score
-    max_followers = df_filtered['follower_count'].max()
+            mask &= FOLLOWER_OPS[op](df['follower_count'].values, value)
+    # Work on gathered arrays rather than a copied slice of the frame
+    sub_idx = np.flatnonzero(mask)
+    # Compute score on raw arrays, accumulating in place through one scratch buffer
+    # Gather the filtered rows first, then cast, so only the subset is converted
+    er = df['engagement_rate_(%)'].to_numpy()[sub_idx].astype('float32', copy=False)
+    fc = df['follower_count'].to_numpy()[sub_idx].astype('float32')
+    al = df['avg_likes_comments'].to_numpy()[sub_idx].astype('float32', copy=False)
+    score = np.multiply(er, w_eng)
+    scratch = np.empty_like(score)
+    # Follower count is normalized against the largest in the filtered set
+    max_followers = fc.max() if fc.size else 0
     if pd.notna(max_followers) and max_followers > 0:
-        df_filtered['Follower_Score'] = df_filtered['follower_count'] / max_followers
-    else:
-        df_filtered['Follower_Score'] = 0
-    # Ensure numeric types
-    df_filtered['engagement_rate_(%)'] = pd.to_numeric(df_filtered['engagement_rate_(%)'], errors='coerce').fillna(0)
-    df_filtered['average_likes/post'] = pd.to_numeric(df_filtered['average_likes/post'], errors='coerce').fillna(0)
-    df_filtered['average_comments/post'] = pd.to_numeric(df_filtered['average_comments/post'], errors='coerce').fillna(0)
-    # Combine likes and comments per post
-    df_filtered['avg_likes_comments'] = df_filtered['average_likes/post'] + df_filtered['average_comments/post']
-    # Compute score
-    df_filtered['Score'] = (
-        df_filtered['engagement_rate_(%)'] * w_eng
-        + df_filtered['Follower_Score'] * w_fol
-        + df_filtered['avg_likes_comments'] * w_likes
-    )
-    ranked = df_filtered.sort_values(by='Score', ascending=False)
+        score += np.multiply(fc, w_fol / max_followers, out=scratch)
+    score += np.multiply(al, w_likes, out=scratch)
+    order = np.argsort(-score)
+    # Single materialization, already in ranked order
+    ranked = df.iloc[sub_idx[order]].assign(Score=score[order])
     return ranked
 
+# Bounded: each slider/filter combination would otherwise pin a DataFrame forever
+@st.cache_data(show_spinner=False, max_entries=32)
+def rank_creators_cached(category, follower_filter=None, w_eng=0.5, w_fol=0.3, w_likes=0.2):
+    # Keyed on the scalar inputs only; df comes from the cached load_data()
+    return rank_creators(df, category, follower_filter, w_eng, w_fol, w_likes)
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def ranked_csv_bytes(category, follower_filter=None, w_eng=0.5, w_fol=0.3, w_likes=0.2):
+    # Serialized once per ranking so reruns don't rebuild the download payload
+    return rank_creators_cached(category, follower_filter, w_eng, w_fol, w_likes).to_csv(index=False).encode()
+
+# ------------------- LLM Result Templates -------------------
+# Static markup built once; only the three extracted fields are filled in per run
+LLM_SUMMARY_HTML = """
+<div style='background-color:#232946; padding:16px; border-radius:10px; color:#eebbc3; font-size:1.1em;'>
+    <b>🔎 For your query, the AI found:</b><br>
+    <span style='color:#eebbc3;'>🏷️ <b>Category:</b> <span style='color:#fffffe;'>{category}</span></span> &nbsp; | &nbsp;
+    <span style='color:#eebbc3;'>👥 <b>Follower Filter:</b> <span style='color:#fffffe;'>{follower_filter}</span></span> &nbsp; | &nbsp;
+    <span style='color:#eebbc3;'>🔽 <b>Sort By:</b> <span style='color:#fffffe;'>{sort_by}</span></span>
+</div>
+"""
+
+LLM_TABLE_CSS = """
+<style>
+.llm-table td, .llm-table th {padding: 8px 16px;}
+.llm-table th {background: #232946; color: #eebbc3;}
+.llm-table td {background: #121629; color: #fffffe;}
+</style>
+"""
+
+LLM_TABLE_HTML = """
+<table class="llm-table">
+    <tr>
+        <th>🏷️ Category</th>
+        <th>👥 Follower Filter</th>
+        <th>🔽 Sort By</th>
+    </tr>
+    <tr>
+        <td>{category}</td>
+        <td>{follower_filter}</td>
+        <td>{sort_by}</td>
+    </tr>
+</table>
+"""
+
 # ------------------- Main App Logic -------------------
+DETAIL_COLUMNS = [
+    'name', 'Score', 'category', 'engagement_rate_(%)', 'follower_count',
+    'avg_likes_comments', 'posting_frequency', 'past_brand_collaborations'
+]
+
 if query:
     # Parse query
     if use_llm:
@@ -149,97 +299,57 @@ if query:
         if parsed:
             st.success("LLM successfully extracted the following filters:")
 
-            # Natural language summary with icons and color
-            st.markdown(
-                f"""
-                <div style='background-color:#232946; padding:16px; border-radius:10px; color:#eebbc3; font-size:1.1em;'>
-                    <b>🔎 For your query, the AI found:</b><br>
-                    <span style='color:#eebbc3;'>🏷️ <b>Category:</b> <span style='color:#fffffe;'>{parsed.get('category', '—')}</span></span> &nbsp; | &nbsp;
-                    <span style='color:#eebbc3;'>👥 <b>Follower Filter:</b> <span style='color:#fffffe;'>{parsed.get('follower_filter', '—')}</span></span> &nbsp; | &nbsp;
-                    <span style='color:#eebbc3;'>🔽 <b>Sort By:</b> <span style='color:#fffffe;'>{parsed.get('sort_by', '—')}</span></span>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
-
-            # Table with icons and color
-            st.markdown(
-                """
-                <style>
-                .llm-table td, .llm-table th {padding: 8px 16px;}
-                .llm-table th {background: #232946; color: #eebbc3;}
-                .llm-table td {background: #121629; color: #fffffe;}
-                </style>
-                """,
-                unsafe_allow_html=True
-            )
-            st.markdown(
-                f"""
-                <table class="llm-table">
-                    <tr>
-                        <th>🏷️ Category</th>
-                        <th>👥 Follower Filter</th>
-                        <th>🔽 Sort By</th>
-                    </tr>
-                    <tr>
-                        <td>{parsed.get('category', '—')}</td>
-                        <td>{parsed.get('follower_filter', '—')}</td>
-                        <td>{parsed.get('sort_by', '—')}</td>
-                    </tr>
-                </table>
-                """,
-                unsafe_allow_html=True
-            )
+            # Natural language summary and table with icons and color
+            fields = {key: parsed.get(key, '—') for key in ('category', 'follower_filter', 'sort_by')}
+            st.markdown(LLM_SUMMARY_HTML.format(**fields), unsafe_allow_html=True)
+            st.markdown(LLM_TABLE_CSS, unsafe_allow_html=True)
+            st.markdown(LLM_TABLE_HTML.format(**fields), unsafe_allow_html=True)
 
             with st.expander("Show raw extracted JSON"):
                 st.json(parsed)
             # Allow user to edit extracted filters
-            category = st.selectbox("Category", categories, index=list(categories).index(parsed.get("category", categories[0])) if parsed.get("category") in categories else 0)
-            follower_filter = st.text_input("Follower Filter (e.g. >10000)", parsed.get("follower_filter", ""))
+            category = st.selectbox("Category", categories, index=categories.index(parsed.get("category", categories[0])) if parsed.get("category") in categories else 0)
+            # Pre-fills the follower filter input below
+            follower_filter = parsed.get("follower_filter") or ""
         else:
             st.warning("LLM parsing failed; using basic extraction.")
             category = st.selectbox("Category", categories)
-            follower_filter = st.text_input("Follower Filter (e.g. >10000)", "")
+            follower_filter = ""
     else:
         category = st.selectbox("Category", categories, index=0)
-        follower_filter = st.text_input("Follower Filter (e.g. >10000)", "")
+        follower_filter = ""
         # Optionally, try to extract category from query
-        cat_basic = extract_category_basic(query, categories)
+        cat_basic = extract_category_basic(query, category_pairs)
         if cat_basic:
             st.info(f"Detected category: {cat_basic}")
             category = cat_basic
     # Show available categories and follower count range for debugging
-    st.write("Available categories:", df['category'].unique())
+    st.write("Available categories:", categories)
     st.write("Follower count range:", df['follower_count'].min(), "-", df['follower_count'].max())
 
     # Add a 'Show All' option for follower filter
-    follower_filter = st.text_input("Follower Filter (e.g. >10000, or leave blank for all)", follower_filter if 'follower_filter' in locals() else "")
+    follower_filter = st.text_input("Follower Filter (e.g. >10000, or leave blank for all)", value=follower_filter)
     if not follower_filter or follower_filter.strip().lower() == 'show all':
         follower_filter = None
 
     # Rank and display
-    ranked_df = rank_creators(df, category, follower_filter, weight_engagement, weight_followers, weight_likes)
+    # Full ranking backs the filtered view and the download; the tables only need the top 10
+    ranked_df = rank_creators_cached(str(category), follower_filter, weight_engagement, weight_followers, weight_likes)
+    top_df = ranked_df.head(10)
     st.write("Filtered DataFrame:", ranked_df)
-    if not ranked_df.empty:
+    if not top_df.empty:
         st.subheader(f"Top {category} creators")
-        # Expandable details for each creator
-        for idx, row in ranked_df.head(5).iterrows():
-            with st.expander(f"{row['name']} (Score: {row['Score']:.2f})"):
-                st.write({
-                    "Category": row['category'],
-                    "Engagement Rate (%)": row['engagement_rate_(%)'],
-                    "Follower count": row['follower_count'],
-                    "Average likes/comments per post": row['avg_likes_comments'],
-                    "Posting frequency": row.get('posting_frequency', 'N/A'),
-                    "Historical brand collaborations": row.get('past_brand_collaborations', 'N/A')
-                })
+        # Details for the top 5 creators, rendered as a single table
+        detail_cols = [c for c in DETAIL_COLUMNS if c in top_df.columns]
+        with st.expander("Creator details (top 5)", expanded=True):
+            st.dataframe(top_df.head(5)[detail_cols], use_container_width=True)
         st.markdown("---")
         st.dataframe(
-            ranked_df[['name', 'category', 'engagement_rate_(%)', 'follower_count', 'Score']].head(10),
+            top_df[['name', 'category', 'engagement_rate_(%)', 'follower_count', 'Score']],
             use_container_width=True
         )
         # Download option
-        csv = ranked_df.to_csv(index=False)
+        csv = ranked_csv_bytes(str(category), follower_filter, weight_engagement, weight_followers, weight_likes)
         st.download_button("Download Results as CSV", csv, "ranked_creators.csv", "text/csv")
     else:
         st.warning("No creators found after applying filters.")